@@ -1,15 +1,18 @@
-from argparse import ArgumentParser
+from argparse import ArgumentParser, ArgumentTypeError, SUPPRESS
 import os
 import platform
 from pathlib import Path
 from shutil import rmtree, unpack_archive, copytree
-from typing import Any
+from typing import Any, Iterable, Iterator, Optional
 import requests
 import json
 import subprocess
 import re
 from enum import Enum
 import sys
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
 
 # set via main
 _ARG_DEBUG = False
@@ -20,6 +23,18 @@ class OutType(Enum):
     pdf = 'pdf'
 
 
+@dataclass(frozen=True)
+class Diagnostic:
+    file: str
+    line: Optional[int]
+    message: str
+
+    def __str__(self) -> str:
+        if self.line is None:
+            return f'{self.file}: {self.message}'
+        return f'{self.file}:{self.line}: {self.message}'
+
+
 HEADER = {'title': 'Generic title',
           'authors': 'Generic author',
           'doctype': 'lnotes',
@@ -95,23 +110,34 @@ class utils:
         open(path, mode='wb').write(data)
 
 
-def _validate_files() -> bool:
+def _validate_mu_files() -> bool:
     try:
         assert FILES_FOLDER_PATH.exists()
         assert MU_FILES_FOLDER_PATH.exists()
-        assert CONTEXT_FILES_FOLDER_PATH.exists()
         assert MU_BINARY_PATH.exists()
-        assert SVGTEX_BINARY_PATH.exists()
         assert CONFIG_PATH.exists()
+
+        cfg = utils.load_config()
+        assert 'mu_version' in cfg
+        assert cfg['mu_version'] == MU_BINARY_URL or cfg['mu_version'] == 'custom'
+    except AssertionError:
+        return False
+
+    return True
+
+
+def _validate_files() -> bool:
+    if not _validate_mu_files():
+        return False
+
+    try:
+        assert CONTEXT_FILES_FOLDER_PATH.exists()
+        assert SVGTEX_BINARY_PATH.exists()
         assert HTML_PATH.exists()
         assert TEX_PATH.exists()
         assert FONTS_PATH.exists()
         assert CONTEXT_BINARY_PATH.exists()
         assert MTXRUN_BINARY_PATH.exists()
-
-        cfg = utils.load_config()
-        assert 'mu_version' in cfg
-        assert cfg['mu_version'] == MU_BINARY_URL or cfg['mu_version'] == 'custom'
     except AssertionError:
         return False
 
@@ -186,6 +212,24 @@ def init_if_needed() -> None:
         _clean_download()
 
 
+def init_mu_if_needed() -> None:
+    """like 'init_if_needed', but only mu is required (no context download)"""
+    if _validate_mu_files():
+        return
+
+    FILES_FOLDER_PATH.mkdir(parents=True, exist_ok=True)
+    if not CONFIG_PATH.exists():
+        utils.save_config({})
+
+    print('Removing old mu files...')
+    rmtree(MU_FILES_FOLDER_PATH, ignore_errors=True)
+
+    _download_mu()
+
+    assert _validate_mu_files(), 'Files werent correctly downloaded, ' + \
+        'please report this at https://github.com/somik861/mu_interactive'
+
+
 def _complete_header(source: str) -> str:
     splitted = source.splitlines()
     found: set[str] = set()
@@ -219,9 +263,117 @@ def _print_if_err(stderr: bytes) -> None:
         print(stderr.decode(encoding='utf-8'), file=sys.stderr)
 
 
+# mu reports errors as '[<file>:]<line>[:<col>]: <message>', the file (if any)
+# must contain a non-digit, so that '<line>:<col>:' is not read as '<file>:<line>:'
+_DIAGNOSTIC_RE = re.compile(
+    r'^(?:(?P<file>(?:[A-Za-z]:)?[^\s:]*[^\d\s:][^\s:]*):)?'
+    r'(?P<line>\d+)(?::(?P<col>\d+))?:\s*(?P<message>.*)$')
+# names mu might use for its standard input
+_STDIN_NAMES = {'-', 'stdin', '<stdin>', '/dev/stdin'}
+
+
+def _parse_diagnostics(stderr: bytes, file: str, line_offset: int = 0) -> list[Diagnostic]:
+    """turn mu's stderr into diagnostics of 'file' (mu's standard input), line
+    numbers are shifted back by 'line_offset' to account for lines added by
+    header completion; diagnostics of other files mu names are kept as they are"""
+    diagnostics: list[Diagnostic] = []
+
+    for raw in stderr.decode(encoding='utf-8', errors='replace').splitlines():
+        if raw.strip() == '':
+            continue
+
+        # indented lines continue the previous message (context, hints, ...)
+        if raw[0].isspace() and diagnostics:
+            last = diagnostics[-1]
+            diagnostics[-1] = Diagnostic(last.file, last.line,
+                                         last.message + '\n' + raw)
+            continue
+
+        match = _DIAGNOSTIC_RE.match(raw.strip())
+        if match is None:
+            diagnostics.append(Diagnostic(file, None, raw.strip()))
+            continue
+
+        if match.group('file') not in _STDIN_NAMES | {None}:
+            diagnostics.append(Diagnostic(match.group('file'), int(match.group('line')),
+                                          match.group('message')))
+            continue
+
+        line = int(match.group('line')) - line_offset
+        if line < 1:
+            diagnostics.append(Diagnostic(
+                file, None, f'in generated header: {match.group("message")}'))
+            continue
+
+        diagnostics.append(Diagnostic(file, line, match.group('message')))
+
+    return diagnostics
+
+
+def check_source(source: str, file: str = '<stdin>',
+                 complete_header: bool = True) -> list[Diagnostic]:
+    """run only the mu front end over 'source', no TeX involved"""
+    line_offset = 0
+    if complete_header:
+        completed = _complete_header(source)
+        line_offset = len(completed.splitlines()) - len(source.splitlines())
+        source = completed
+
+    if not source.endswith('\n'):
+        source += '\n'
+
+    result = subprocess.run([MU_BINARY_PATH, '--html'],
+                            input=source.encode(encoding='utf-8'), capture_output=True)
+
+    diagnostics = _parse_diagnostics(result.stderr, file, line_offset)
+    if result.returncode != 0 and not diagnostics:
+        diagnostics.append(Diagnostic(
+            file, None, f'mu exited with code {result.returncode}'))
+
+    return diagnostics
+
+
+def check_files(inputs: Iterable[str],
+                complete_header: bool = True,
+                jobs: Optional[int] = None) -> Iterator[tuple[str, list[Diagnostic]]]:
+    """check 'inputs' in parallel, yields (file, diagnostics) as each file finishes"""
+    def check_file(inp: str) -> list[Diagnostic]:
+        try:
+            source = open(inp, 'r', encoding='utf-8').read()
+        except (OSError, UnicodeDecodeError) as e:
+            return [Diagnostic(inp, None, str(e))]
+
+        return check_source(source, inp, complete_header)
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        futures = {executor.submit(check_file, inp): inp for inp in inputs}
+        for future in as_completed(futures):
+            yield futures[future], future.result()
+
+
+def check(inputs: list[str],
+          complete_header: bool = True,
+          jobs: Optional[int] = None) -> bool:
+    """print diagnostics of all 'inputs', returns True if all are valid"""
+    init_mu_if_needed()
+
+    valid = True
+    for _, diagnostics in check_files(inputs, complete_header, jobs):
+        for diagnostic in diagnostics:
+            print(diagnostic, file=sys.stderr, flush=True)
+        valid = valid and not diagnostics
+
+    return valid
+
+
+def _add_context_to_path() -> None:
+    context_path = str(CONTEXT_BINARY_PATH.parent)
+    if context_path not in os.environ['PATH'].split(os.pathsep):
+        os.environ['PATH'] = context_path + os.pathsep + os.environ['PATH']
+
+
 def get_html(source: str) -> bytes:
-    # add context to path
-    os.environ['PATH'] = f'{str(CONTEXT_BINARY_PATH.parent)}:' + os.environ['PATH'] 
+    _add_context_to_path()
 
     result = subprocess.run([MU_BINARY_PATH, '--html', '--embed', HTML_PATH],
                             input=source.encode(encoding='utf-8'), capture_output=True)
@@ -230,17 +382,19 @@ def get_html(source: str) -> bytes:
     tex_cache = Path(os.path.join(FILES_FOLDER_PATH, 'texmf_cache'))
     tex_cache.mkdir(parents=True, exist_ok=True)
 
-    os.putenv('TEXINPUTS', str(TEX_PATH))
-    os.putenv('OSFONTDIR', str(FONTS_PATH))
-    os.putenv('TEXMFCACHE', str(tex_cache))
+    try:
+        os.putenv('TEXINPUTS', str(TEX_PATH))
+        os.putenv('OSFONTDIR', str(FONTS_PATH))
+        os.putenv('TEXMFCACHE', str(tex_cache))
 
-    subprocess.run([MTXRUN_BINARY_PATH, '--generate'], capture_output=True)
+        subprocess.run([MTXRUN_BINARY_PATH, '--generate'], capture_output=True)
 
-    result = subprocess.run([SVGTEX_BINARY_PATH],
-                            input=result.stdout, capture_output=True)
-    _print_if_err(result.stderr)
+        result = subprocess.run([SVGTEX_BINARY_PATH],
+                                input=result.stdout, capture_output=True)
+        _print_if_err(result.stderr)
+    finally:
+        rmtree(tex_cache, ignore_errors=True)
 
-    rmtree(tex_cache, ignore_errors=True)
     return result.stdout
 
 
@@ -251,41 +405,42 @@ def get_pdf(source: str) -> bytes:
     tex_cache = Path(os.path.join(FILES_FOLDER_PATH, 'texmf_cache'))
     tex_cache.mkdir(parents=True, exist_ok=True)
 
-    # add context to path
-    os.environ['PATH'] = f'{str(CONTEXT_BINARY_PATH.parent)}:' + os.environ['PATH']
+    try:
+        _add_context_to_path()
 
-    os.putenv('TEXINPUTS', str(TEX_PATH))
-    os.putenv('OSFONTDIR', str(FONTS_PATH))
-    os.putenv('TEXMFCACHE', str(tex_cache))
+        os.putenv('TEXINPUTS', str(TEX_PATH))
+        os.putenv('OSFONTDIR', str(FONTS_PATH))
+        os.putenv('TEXMFCACHE', str(tex_cache))
 
-    if platform.system() == 'Windows':
-        os.putenv('PLATFORM', 'win64')
-        os.putenv('OWNPATH', str(CONTEXT_FILES_FOLDER_PATH))
+        if platform.system() == 'Windows':
+            os.putenv('PLATFORM', 'win64')
+            os.putenv('OWNPATH', str(CONTEXT_FILES_FOLDER_PATH))
 
-    subprocess.run([MTXRUN_BINARY_PATH, '--generate'], capture_output=True)
-    subprocess.run([CONTEXT_BINARY_PATH, '--make'], capture_output=True)
+        subprocess.run([MTXRUN_BINARY_PATH, '--generate'], capture_output=True)
+        subprocess.run([CONTEXT_BINARY_PATH, '--make'], capture_output=True)
 
-    txt_file = os.path.join(build_path, 'source.txt')
-    open(txt_file, 'w', encoding='utf-8', newline='\n').write(source)
+        txt_file = os.path.join(build_path, 'source.txt')
+        open(txt_file, 'w', encoding='utf-8', newline='\n').write(source)
 
-    result = subprocess.run([MU_BINARY_PATH, txt_file], capture_output=True)
-    _print_if_err(result.stderr)
+        result = subprocess.run([MU_BINARY_PATH, txt_file], capture_output=True)
+        _print_if_err(result.stderr)
 
-    tex_file = os.path.join(build_path, 'source.tex')
-    open(tex_file, 'w', encoding='utf-8',
-         newline='\n').write(result.stdout.decode(encoding='utf-8'))
+        tex_file = os.path.join(build_path, 'source.tex')
+        open(tex_file, 'w', encoding='utf-8',
+             newline='\n').write(result.stdout.decode(encoding='utf-8'))
 
-    result = subprocess.run([CONTEXT_BINARY_PATH, tex_file],
-                   cwd=build_path, capture_output=True)
-    _print_if_err(result.stderr)
+        result = subprocess.run([CONTEXT_BINARY_PATH, tex_file],
+                       cwd=build_path, capture_output=True)
+        _print_if_err(result.stderr)
 
-    data = open(os.path.join(build_path, 'source.pdf'), 'rb').read()
+        data = open(os.path.join(build_path, 'source.pdf'), 'rb').read()
 
-    if _ARG_DEBUG:
-        copytree(build_path, 'mu_gen_logs', dirs_exist_ok=True)
+        if _ARG_DEBUG:
+            copytree(build_path, 'mu_gen_logs', dirs_exist_ok=True)
+    finally:
+        rmtree(build_path, ignore_errors=True)
+        rmtree(tex_cache, ignore_errors=True)
 
-    rmtree(build_path, ignore_errors=True)
-    rmtree(tex_cache, ignore_errors=True)
     return data
 
 
@@ -315,20 +470,212 @@ def main(type_: OutType,
         open(out, 'wb').write(pdf)
 
 
-if __name__ == '__main__':
-    parser = ArgumentParser()
+def _snapshot(paths: Iterable[Path]) -> dict[Path, tuple[int, int]]:
+    """(mtime, size) of every file in 'paths', directories are walked recursively"""
+    result: dict[Path, tuple[int, int]] = {}
+
+    for path in paths:
+        files = path.rglob('*') if path.is_dir() else [path]
+        for file in files:
+            try:
+                stat = file.stat()
+            except OSError:
+                continue
+            if file.is_file():
+                result[file] = (stat.st_mtime_ns, stat.st_size)
+
+    return result
+
+
+def _changed(old: dict[Path, tuple[int, int]], new: dict[Path, tuple[int, int]]) -> set[Path]:
+    return {path for path in old.keys() | new.keys() if old.get(path) != new.get(path)}
+
 
-    parser.add_argument('type', metavar='TYPE', type=str,
-                        choices=['html', 'pdf'])
-    parser.add_argument('i', metavar='IN_FILE', type=str, help='Input file')
-    parser.add_argument('o', metavar='OUT_FILE', type=str, help='Output file')
-    parser.add_argument('--no_header', required=False,
+def _outputs(type_: OutType,
+             inputs: list[str], out_dir: Optional[str] = None) -> dict[Path, str]:
+    """map (resolved) input files to their output files"""
+    extension = '.' + type_.value
+    outputs: dict[Path, str] = {}
+    for inp in inputs:
+        folder = Path(out_dir) if out_dir is not None else Path(inp).parent
+        outputs[Path(inp).resolve()] = os.path.join(folder, Path(inp).stem + extension)
+
+    targets: dict[Path, Path] = {}
+    for inp, out in outputs.items():
+        target = Path(out).resolve()
+        # inputs are watched, rendering over one would overwrite it and loop forever
+        assert target not in outputs, f'Output {out} of {inp} would overwrite input {target}'
+        assert target not in targets, \
+            f'Both {targets.get(target)} and {inp} would be rendered to {out}'
+        targets[target] = inp
+
+    return outputs
+
+
+def _affected(changed: set[Path], inputs: Iterable[Path], assets: list[Path]) -> set[Path]:
+    """inputs that have to be re-rendered after 'changed' files changed"""
+    if any(asset in path.parents for path in changed for asset in assets):
+        return set(inputs)
+
+    return changed & set(inputs)
+
+
+def _settle(watched: list[Path], current: dict[Path, tuple[int, int]],
+            delay: float) -> tuple[dict[Path, tuple[int, int]], set[Path]]:
+    """wait until nothing in 'watched' changed for 'delay' seconds,
+    returns the settled snapshot and files changed since 'current'"""
+    changed: set[Path] = set()
+    while True:
+        time.sleep(delay)
+        settled = _snapshot(watched)
+        burst = _changed(current, settled)
+        current = settled
+        if not burst:
+            return current, changed
+        changed |= burst
+
+
+def watch(type_: OutType,
+          inputs: list[str], out_dir: Optional[str] = None,
+          complete_header: bool = True,
+          interval: float = 0.5, delay: float = 0.2) -> None:
+    """re-render outputs whenever their input file or the shared assets change
+
+    events are coalesced until nothing changed for 'delay' seconds, renders
+    run one at a time, as they share build and cache folders"""
+    outputs = _outputs(type_, inputs, out_dir)
+    if out_dir is not None:
+        Path(out_dir).mkdir(parents=True, exist_ok=True)
+
+    init_if_needed()
+
+    # assets every output depends on
+    assets = [TEX_PATH, FONTS_PATH]
+    if type_ is OutType.html:
+        assets.append(HTML_PATH)
+
+    def render(dirty: set[Path], since: float) -> None:
+        for inp in sorted(dirty):
+            start = time.perf_counter()
+            try:
+                main(type_, str(inp), outputs[inp], complete_header)
+            except Exception as e:
+                print(f'ERROR: {inp}: {e}', file=sys.stderr)
+                continue
+            end = time.perf_counter()
+            print(f'Rebuilt {outputs[inp]} in {end - start:.2f} s '
+                  f'({end - since:.2f} s since change)', flush=True)
+
+    watched = list(outputs.keys()) + assets
+    try:
+        state = _snapshot(watched)
+        render(set(outputs), time.perf_counter())
+
+        print('Watching for changes, press Ctrl+C to stop...', flush=True)
+        while True:
+            time.sleep(interval)
+            current = _snapshot(watched)
+            changed = _changed(state, current)
+            if not changed:
+                continue
+
+            since = time.perf_counter()
+            # coalesce bursts of events (editors saving in several steps, ...)
+            state, burst = _settle(watched, current, delay)
+            render(_affected(changed | burst, outputs.keys(), assets), since)
+    except KeyboardInterrupt:
+        pass
+
+
+def _positive_int(value: str) -> int:
+    try:
+        number = int(value)
+    except ValueError:
+        raise ArgumentTypeError(f'expected a positive number, got {value}')
+
+    if number < 1:
+        raise ArgumentTypeError(f'expected a positive number, got {value}')
+
+    return number
+
+
+def _positive_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise ArgumentTypeError(f'expected a positive number, got {value}')
+
+    if not number > 0:
+        raise ArgumentTypeError(f'expected a positive number, got {value}')
+
+    return number
+
+
+def _non_negative_float(value: str) -> float:
+    try:
+        number = float(value)
+    except ValueError:
+        raise ArgumentTypeError(f'expected a non-negative number, got {value}')
+
+    if not number >= 0:
+        raise ArgumentTypeError(f'expected a non-negative number, got {value}')
+
+    return number
+
+
+def _add_common_arguments(parser: ArgumentParser, default: Any) -> None:
+    parser.add_argument('--no_header', required=False, default=default,
                         action='store_true', help='Disable automatic header completion')
-    parser.add_argument('--debug', action='store_true',
+    parser.add_argument('--debug', action='store_true', default=default,
                         required=False, help='Save logs of outputs to current working directory')
 
+
+if __name__ == '__main__':
+    parser = ArgumentParser()
+    # accepted both before and after TYPE, subcommands do not override
+    # values given before TYPE
+    _add_common_arguments(parser, False)
+    subparsers = parser.add_subparsers(dest='type', metavar='TYPE', required=True)
+
+    for type_ in OutType:
+        type_parser = subparsers.add_parser(type_.value,
+                                            help=f'Generate {type_.value} output')
+        type_parser.add_argument('i', metavar='IN_FILE', type=str, help='Input file')
+        type_parser.add_argument('o', metavar='OUT_FILE', type=str, help='Output file')
+        _add_common_arguments(type_parser, SUPPRESS)
+
+    check_parser = subparsers.add_parser('check',
+                                         help='Only validate input files, without typesetting')
+    check_parser.add_argument('i', metavar='IN_FILE', type=str, nargs='+', help='Input files')
+    check_parser.add_argument('--no_header', required=False, default=SUPPRESS,
+                              action='store_true', help='Disable automatic header completion')
+    check_parser.add_argument('--jobs', '-j', metavar='N', type=_positive_int, default=os.cpu_count(),
+                              help='Number of files checked in parallel; default=number of CPUs')
+
+    watch_parser = subparsers.add_parser('watch',
+                                         help='Re-render input files whenever they change')
+    watch_parser.add_argument('output_type', metavar='OUT_TYPE', type=str,
+                              choices=[t.value for t in OutType])
+    watch_parser.add_argument('i', metavar='IN_FILE', type=str, nargs='+', help='Input files')
+    watch_parser.add_argument('--out_dir', '-o', metavar='DIR', type=str, default=None,
+                              help='Output folder; default=folder of each input file')
+    watch_parser.add_argument('--interval', metavar='S', type=_positive_float, default=0.5,
+                              help='Polling interval in seconds; default=0.5')
+    watch_parser.add_argument('--delay', metavar='S', type=_non_negative_float, default=0.2,
+                              help='Quiet period used to coalesce changes in seconds; default=0.2')
+    _add_common_arguments(watch_parser, SUPPRESS)
+
     args = parser.parse_args()
 
+    if args.type == 'watch':
+        _ARG_DEBUG = args.debug
+        watch(OutType(args.output_type), args.i, args.out_dir,
+              not args.no_header, args.interval, args.delay)
+        sys.exit(0)
+
+    if args.type == 'check':
+        sys.exit(0 if check(args.i, not args.no_header, args.jobs) else 1)
+
     _ARG_DEBUG = args.debug
 
     main(OutType(args.type), args.i, args.o, not args.no_header)
@@ -0,0 +1,297 @@
+import os
+import subprocess
+import tempfile
+import unittest
+from argparse import ArgumentTypeError
+from pathlib import Path
+from typing import Any, Callable
+from unittest import mock
+
+import mu_gen
+from mu_gen import Diagnostic
+
+
+def _fake_mu(args: list[Any], input: bytes, capture_output: bool) -> subprocess.CompletedProcess:
+    """report an error on every line of the input containing 'BAD'"""
+    lines = input.decode(encoding='utf-8').splitlines()
+    stderr = ''.join(f'{i}:3: unexpected token\n'
+                     for i, line in enumerate(lines, start=1) if 'BAD' in line)
+
+    return subprocess.CompletedProcess(args, 1 if stderr else 0,
+                                       b'', stderr.encode(encoding='utf-8'))
+
+
+class TestParseDiagnostics(unittest.TestCase):
+    def test_line(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'7: unexpected token\n', 'a.mu'),
+                         [Diagnostic('a.mu', 7, 'unexpected token')])
+
+    def test_line_col(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'7:3: unexpected token\n', 'a.mu'),
+                         [Diagnostic('a.mu', 7, 'unexpected token')])
+
+    def test_file(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'-:7:3: unexpected token\n', 'a.mu'),
+                         [Diagnostic('a.mu', 7, 'unexpected token')])
+        self.assertEqual(mu_gen._parse_diagnostics(b'x/1.mu:7: unexpected token\n', 'a.mu'),
+                         [Diagnostic('x/1.mu', 7, 'unexpected token')])
+        self.assertEqual(mu_gen._parse_diagnostics(b'C:\\x\\y.mu:3: err\n', 'a.mu'),
+                         [Diagnostic('C:\\x\\y.mu', 3, 'err')])
+
+    def test_message_with_numbers(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'7:3: expected 2: got 1\n', 'a.mu'),
+                         [Diagnostic('a.mu', 7, 'expected 2: got 1')])
+
+    def test_line_offset(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'7:3: unexpected token\n', 'a.mu', 5),
+                         [Diagnostic('a.mu', 2, 'unexpected token')])
+
+    def test_error_in_header(self) -> None:
+        self.assertEqual(mu_gen._parse_diagnostics(b'2: bad key\n', 'a.mu', 5),
+                         [Diagnostic('a.mu', None, 'in generated header: bad key')])
+
+    def test_continuation(self) -> None:
+        stderr = b'7: unexpected token\n  some context\n\terror: other\n'
+        self.assertEqual(mu_gen._parse_diagnostics(stderr, 'a.mu'),
+                         [Diagnostic('a.mu', 7, 'unexpected token\n  some context\n\terror: other')])
+
+    def test_other_file(self) -> None:
+        stderr = b'x/macros.mu:3:1: unknown macro\n-:9: bad\n<stdin>:8: worse\n'
+        self.assertEqual(mu_gen._parse_diagnostics(stderr, 'a.mu', 5),
+                         [Diagnostic('x/macros.mu', 3, 'unknown macro'),
+                          Diagnostic('a.mu', 4, 'bad'),
+                          Diagnostic('a.mu', 3, 'worse')])
+
+    def test_unmatched_lines_are_separate(self) -> None:
+        stderr = b'something went wrong\nerror: other\n8: third\n'
+        self.assertEqual(mu_gen._parse_diagnostics(stderr, 'a.mu'),
+                         [Diagnostic('a.mu', None, 'something went wrong'),
+                          Diagnostic('a.mu', None, 'error: other'),
+                          Diagnostic('a.mu', 8, 'third')])
+
+
+@mock.patch('mu_gen.subprocess.run', _fake_mu)
+class TestCheckSource(unittest.TestCase):
+    def test_valid(self) -> None:
+        self.assertEqual(mu_gen.check_source('hello\n', 'a.mu'), [])
+
+    def test_no_header(self) -> None:
+        source = 'hello\nBAD\n'
+        self.assertEqual(mu_gen.check_source(source, 'a.mu'),
+                         [Diagnostic('a.mu', 2, 'unexpected token')])
+
+    def test_partial_header(self) -> None:
+        source = ': title : Mine\n: authors : Me\n\nhello\nBAD\n'
+        self.assertEqual(mu_gen.check_source(source, 'a.mu'),
+                         [Diagnostic('a.mu', 5, 'unexpected token')])
+
+    def test_full_header(self) -> None:
+        source = ''.join(f': {key} : x\n' for key in mu_gen.HEADER) + '\nBAD\n'
+        self.assertEqual(mu_gen.check_source(source, 'a.mu'),
+                         [Diagnostic('a.mu', 6, 'unexpected token')])
+
+    def test_header_disabled(self) -> None:
+        self.assertEqual(mu_gen.check_source('BAD', 'a.mu', complete_header=False),
+                         [Diagnostic('a.mu', 1, 'unexpected token')])
+
+
+@mock.patch('mu_gen.subprocess.run', _fake_mu)
+class TestCheckFiles(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name)
+
+        self.good = str(self.root / 'good.mu')
+        self.bad = str(self.root / 'bad.mu')
+        Path(self.good).write_text('hello\n', encoding='utf-8')
+        Path(self.bad).write_text('hello\nBAD\n', encoding='utf-8')
+
+    def test_check_files(self) -> None:
+        results = dict(mu_gen.check_files([self.good, self.bad], jobs=2))
+        self.assertEqual(results, {self.good: [],
+                                   self.bad: [Diagnostic(self.bad, 2, 'unexpected token')]})
+
+    def test_unreadable(self) -> None:
+        missing = str(self.root / 'missing.mu')
+        binary = self.root / 'binary.mu'
+        binary.write_bytes(b'\xff\xfe\xfa')
+
+        results = dict(mu_gen.check_files([missing, str(binary)]))
+        for file in (missing, str(binary)):
+            self.assertEqual(len(results[file]), 1)
+            self.assertEqual(results[file][0].file, file)
+            self.assertIsNone(results[file][0].line)
+
+    @mock.patch('mu_gen.init_mu_if_needed')
+    @mock.patch('sys.stderr')
+    def test_check(self, stderr: mock.Mock, init: mock.Mock) -> None:
+        self.assertTrue(mu_gen.check([self.good]))
+        self.assertFalse(mu_gen.check([self.good, self.bad]))
+        self.assertFalse(mu_gen.check([self.bad, self.good]))
+        init.assert_called()
+
+
+class TestPositiveInt(unittest.TestCase):
+    def test_valid(self) -> None:
+        self.assertEqual(mu_gen._positive_int('3'), 3)
+
+    def test_invalid(self) -> None:
+        for value in ('0', '-1', 'x'):
+            with self.assertRaises(ArgumentTypeError):
+                mu_gen._positive_int(value)
+
+
+class TestFloatArguments(unittest.TestCase):
+    def test_positive_float(self) -> None:
+        self.assertEqual(mu_gen._positive_float('0.5'), 0.5)
+        for value in ('0', '-1', 'x', 'nan'):
+            with self.assertRaises(ArgumentTypeError):
+                mu_gen._positive_float(value)
+
+    def test_non_negative_float(self) -> None:
+        self.assertEqual(mu_gen._non_negative_float('0'), 0)
+        self.assertEqual(mu_gen._non_negative_float('0.2'), 0.2)
+        for value in ('-0.1', 'x', 'nan'):
+            with self.assertRaises(ArgumentTypeError):
+                mu_gen._non_negative_float(value)
+
+
+def _append(path: Path, text: str = 'x') -> None:
+    """change both content and size, mtime resolution might be too coarse"""
+    with open(path, 'a', encoding='utf-8') as f:
+        f.write(text)
+
+
+class TestWatch(unittest.TestCase):
+    def setUp(self) -> None:
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.root = Path(tmp.name).resolve()
+
+        self.tex = self.root / 'tex'
+        self.fonts = self.root / 'fonts'
+        self.tex.mkdir()
+        self.fonts.mkdir()
+        (self.tex / 'style.tex').write_text('x', encoding='utf-8')
+
+        self.a = self.root / 'a.mu'
+        self.b = self.root / 'b.mu'
+        self.a.write_text('a', encoding='utf-8')
+        self.b.write_text('b', encoding='utf-8')
+        self.assets = [self.tex, self.fonts]
+        self.watched = [self.a, self.b] + self.assets
+
+    def test_snapshot_changes(self) -> None:
+        old = mu_gen._snapshot(self.watched)
+        self.assertIn(self.tex / 'style.tex', old)
+
+        _append(self.a)
+        (self.tex / 'style.tex').unlink()
+        (self.fonts / 'new.otf').write_text('x', encoding='utf-8')
+
+        self.assertEqual(mu_gen._changed(old, mu_gen._snapshot(self.watched)),
+                         {self.a, self.tex / 'style.tex', self.fonts / 'new.otf'})
+
+    def test_deleted_input(self) -> None:
+        old = mu_gen._snapshot(self.watched)
+        self.b.unlink()
+
+        changed = mu_gen._changed(old, mu_gen._snapshot(self.watched))
+        self.assertEqual(changed, {self.b})
+        self.assertEqual(mu_gen._affected(changed, [self.a, self.b], self.assets), {self.b})
+
+    def test_affected(self) -> None:
+        inputs = [self.a, self.b]
+        self.assertEqual(mu_gen._affected({self.a}, inputs, self.assets), {self.a})
+        self.assertEqual(mu_gen._affected({self.tex / 'style.tex'}, inputs, self.assets),
+                         {self.a, self.b})
+        self.assertEqual(mu_gen._affected({self.root / 'other.mu'}, inputs, self.assets),
+                         set())
+
+    def test_settle_coalesces_bursts(self) -> None:
+        current = mu_gen._snapshot(self.watched)
+        edits: list[Callable[[], None]] = [lambda: _append(self.a),
+                                           lambda: _append(self.b),
+                                           lambda: None]
+
+        with mock.patch('mu_gen.time.sleep', lambda _: edits.pop(0)()):
+            settled, changed = mu_gen._settle(self.watched, current, 0.2)
+
+        self.assertEqual(edits, [])
+        self.assertEqual(changed, {self.a, self.b})
+        self.assertEqual(settled, mu_gen._snapshot(self.watched))
+
+    def test_outputs(self) -> None:
+        out_dir = str(self.root / 'out')
+        self.assertEqual(mu_gen._outputs(mu_gen.OutType.pdf, [str(self.a)], out_dir),
+                         {self.a: os.path.join(out_dir, 'a.pdf')})
+        self.assertEqual(mu_gen._outputs(mu_gen.OutType.html, [str(self.a)]),
+                         {self.a: os.path.join(self.root, 'a.html')})
+
+    def test_outputs_same_stem(self) -> None:
+        other = self.root / 'sub' / 'a.mu'
+        other.parent.mkdir()
+        other.write_text('a', encoding='utf-8')
+
+        with self.assertRaises(AssertionError):
+            mu_gen._outputs(mu_gen.OutType.pdf, [str(self.a), str(other)],
+                            str(self.root / 'out'))
+
+    def test_outputs_overwrite_input(self) -> None:
+        page = self.root / 'page.html'
+        page.write_text('x', encoding='utf-8')
+
+        with self.assertRaises(AssertionError):
+            mu_gen._outputs(mu_gen.OutType.html, [str(page)])
+        with self.assertRaises(AssertionError):
+            mu_gen._outputs(mu_gen.OutType.pdf, [str(self.a), str(self.root / 'out' / 'a.pdf')],
+                            str(self.root / 'out'))
+
+    def _watch(self, steps: list[Callable[[], None]]) -> list[str]:
+        """run watch over 'a' and 'b', every sleep performs one of 'steps',
+        returns the rendered inputs (including the initial build)"""
+        rendered: list[str] = []
+
+        def sleep(_: float) -> None:
+            if not steps:
+                raise KeyboardInterrupt
+            steps.pop(0)()
+
+        with mock.patch('mu_gen.init_if_needed'), \
+                mock.patch('mu_gen.main', lambda _, inp, *args: rendered.append(inp)), \
+                mock.patch('mu_gen.time.sleep', sleep), \
+                mock.patch('mu_gen.TEX_PATH', self.tex), \
+                mock.patch('mu_gen.FONTS_PATH', self.fonts), \
+                mock.patch('sys.stdout'):
+            mu_gen.watch(mu_gen.OutType.pdf, [str(self.a), str(self.b)],
+                         str(self.root / 'out'))
+
+        self.assertTrue((self.root / 'out').is_dir())
+        return rendered
+
+    def test_watch_input_changed(self) -> None:
+        # interval sleep: edit 'a' twice in a burst, then it settles
+        rendered = self._watch([lambda: _append(self.a),
+                                lambda: _append(self.a),
+                                lambda: None])
+        self.assertEqual(rendered, [str(self.a), str(self.b), str(self.a)])
+
+    def test_watch_asset_changed(self) -> None:
+        rendered = self._watch([lambda: _append(self.tex / 'style.tex'),
+                                lambda: None])
+        self.assertEqual(rendered, [str(self.a), str(self.b), str(self.a), str(self.b)])
+
+
+class TestContextPath(unittest.TestCase):
+    def test_idempotent(self) -> None:
+        with mock.patch.dict(os.environ, {'PATH': os.pathsep.join(['x', 'y'])}):
+            mu_gen._add_context_to_path()
+            path = os.environ['PATH']
+            mu_gen._add_context_to_path()
+            self.assertEqual(os.environ['PATH'], path)
+            self.assertEqual(path.split(os.pathsep)[0], str(mu_gen.CONTEXT_BINARY_PATH.parent))
+
+
+if __name__ == '__main__':
+    unittest.main()